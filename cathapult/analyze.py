@@ -1,28 +1,49 @@
+import duckdb
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import re
+from functools import lru_cache
 from pathlib import Path
 
+# "<id> <representative> :<name>"; the id is the second-to-last token before
+# the first ":", and names may themselves contain ":"
+CATH_NAMES_RE = r"^(?:[^:]*\s)?(?P<CATH_ID>[^\s:]+)\s+[^\s:]+\s*:\s*(?P<NAME>.*?)\s*$"
+
+@lru_cache(maxsize=4)
 def load_reference_data(data_dir):
-    # Load CATH names
-    cath_names = []
-    with open(data_dir / "cath-names.txt") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            if ":" in line:
-                left, name = line.split(":", 1)
-                cath_id = left.strip().split()[-2]
-                cath_names.append((cath_id, name.strip()))
-    df_cath_names = pd.DataFrame(cath_names, columns=["CATH_ID", "NAME"])
-
-    # Load CATH superfamily list (tab-delimited)
-    df_cath_super = pd.read_csv(data_dir / "cath-superfamily-list.txt", sep="\t", dtype=str)
+    # Load CATH names: read whole lines with the Arrow CSV reader (using a
+    # delimiter that never occurs) and parse them with Arrow compute kernels
+    lines = pacsv.read_csv(
+        data_dir / "cath-names.txt",
+        read_options=pacsv.ReadOptions(column_names=["line"]),
+        parse_options=pacsv.ParseOptions(delimiter="\x1f", quote_char=False),
+        convert_options=pacsv.ConvertOptions(column_types={"line": pa.string()}),
+    )["line"]
+    lines = lines.filter(pc.invert(pc.starts_with(pc.utf8_ltrim_whitespace(lines), "#")))
+    parsed = pc.extract_regex(lines, CATH_NAMES_RE)
+    parsed = parsed.filter(pc.is_valid(parsed))
+    df_cath_names = pd.DataFrame({
+        "CATH_ID": pc.struct_field(parsed, "CATH_ID").to_pandas(),
+        "NAME": pc.struct_field(parsed, "NAME").to_pandas(),
+    })
+
+    # Load CATH superfamily list (tab-delimited), kept as Arrow-backed strings
+    df_cath_super = pd.read_csv(
+        data_dir / "cath-superfamily-list.txt", sep="\t", engine="pyarrow", dtype="string[pyarrow]"
+    )
 
     return df_cath_names, df_cath_super
 
 import pandas as pd
 
+# Anchored prefixes of a dotted CATH label, e.g. "3.40.50.300" -> "3", "3.40", "3.40.50"
+FIRST_LEVEL_RE = re.compile(r"^([^.]+)")
+TWO_LEVELS_RE = re.compile(r"^([^.]+(?:\.[^.]+)?)")
+THREE_LEVELS_RE = re.compile(r"^([^.]+(?:\.[^.]+){0,2})")
+
 def extract_domain_levels(df):
     # Check column exists
     if "domain" not in df.columns:
@@ -31,125 +52,126 @@ def extract_domain_levels(df):
     # Work on a copy to avoid modifying original unintentionally
     df = df.copy()
 
-    # Ensure string type and handle None/NaN safely
-    domain_series = df["domain"].fillna("").astype(str)
+    # Labels repeat heavily (thousands of distinct labels across millions of
+    # rows), so derive levels once per distinct label and broadcast back.
+    # Categorical columns reuse their codes; None/NaN get code -1
+    codes, labels = pd.factorize(df["domain"])
+    labels = pd.Series(labels, dtype=object).astype(str)
+
+    # Deepest label in the frame, counted like str.split(".", expand=True) columns
+    depth = int(labels.str.count(r"\.").max()) + 1 if len(labels) else 1
+
+    # Slice each level straight out of the label; empty or missing labels become NaN.
+    # A level column is only filled when some label in the frame reaches that depth,
+    # in which case labels with fewer levels keep what they have
+    for col, pattern, min_depth in [
+        ("domain.first.level", FIRST_LEVEL_RE, 1),
+        ("domain.two.levels", TWO_LEVELS_RE, 2),
+        ("domain.three.levels", THREE_LEVELS_RE, 3),
+    ]:
+        if depth < min_depth:
+            df[col] = np.nan
+            continue
+        levels = labels.str.extract(pattern, expand=False).to_numpy()
+        # Trailing NaN is what code -1 picks up
+        df[col] = np.append(levels, np.nan)[codes]
 
-    # Split safely
-    domain_split = domain_series.str.split(".", expand=True)
+    return df
 
-    # First level (always safe if string is not empty)
-    df["domain.first.level"] = domain_split[0].replace("", pd.NA)
+@lru_cache(maxsize=4)
+def load_domain_names(data_dir):
+    cath_names, cath_super = load_reference_data(data_dir)
 
-    # Two levels (only if second level exists)
-    if domain_split.shape[1] >= 2:
-        df["domain.two.levels"] = (
-            domain_split[[0, 1]]
-            .apply(lambda x: ".".join(filter(None, x)), axis=1)
-            .replace("", pd.NA)
-        )
-    else:
-        df["domain.two.levels"] = pd.NA
-
-    # Three levels (only if third level exists)
-    if domain_split.shape[1] >= 3:
-        df["domain.three.levels"] = (
-            domain_split[[0, 1, 2]]
-            .apply(lambda x: ".".join(filter(None, x)), axis=1)
-            .replace("", pd.NA)
-        )
-    else:
-        df["domain.three.levels"] = pd.NA
+    # One id -> name lookup: cath-names.txt wins, cath-superfamily-list.txt fills the rest
+    lookup = pd.concat([
+        cath_names[["CATH_ID", "NAME"]],
+        cath_super.rename(columns={"# CATH_ID": "CATH_ID"})[["CATH_ID", "NAME"]],
+    ]).dropna(subset=["NAME"]).drop_duplicates(subset="CATH_ID", keep="first")
 
-    return df
-
-def count_domains(df, col, unique_gene=False):
-    sub = df[["gene", col]].dropna()
-    if unique_gene:
-        sub = sub.drop_duplicates()
-    counts = sub[col].value_counts().reset_index()
-    counts.columns = ["domain", "count"]
-    return counts
+    # Kept as a unique-indexed Series (not a dict) so its hash table is built
+    # once and reused by every .map across calls
+    return lookup.set_index("CATH_ID")["NAME"]
 
 def annotate_domains(counts_df):
     # Load reference data
     data_dir = Path(__file__).parent / "data"
-    cath_names, cath_super = load_reference_data(data_dir)
-    
-    # Deduplicate CATH names to avoid InvalidIndexError
-    cath_names_unique = cath_names.drop_duplicates(subset="CATH_ID", keep="first")
+    domain_names = load_domain_names(data_dir)
 
-    # First: match using cath-names.txt
     annotated = counts_df.copy()
-    annotated["domain.name"] = annotated["domain"].map(
-        cath_names_unique.set_index("CATH_ID")["NAME"]
-    )
-
-    # Second: fill remaining names using cath-superfamily-list.txt
-    annotated["domain.name"] = annotated["domain.name"].fillna(
-        cath_super.set_index("# CATH_ID")["NAME"]
-    )
+    annotated["domain.name"] = annotated["domain"].map(domain_names)
 
     return annotated
 
 def deep_annotate_domains(df):
     # Load reference data
     data_dir = Path(__file__).parent / "data"
-    cath_names, cath_super = load_reference_data(data_dir)
-    
-    # Deduplicate CATH names to avoid InvalidIndexError
-    cath_names_unique = cath_names.drop_duplicates(subset="CATH_ID", keep="first")
+    domain_names = load_domain_names(data_dir)
 
     df = extract_domain_levels(df)
     
-    # First: match using cath-names.txt
     annotated = df.copy()
-    annotated["domain.name"] = annotated["domain"].map(
-        cath_names_unique.set_index("CATH_ID")["NAME"]
-    )
-
-    # Second: fill remaining names using cath-superfamily-list.txt
-    annotated["domain.name"] = annotated["domain.name"].fillna(
-        cath_super.set_index("# CATH_ID")["NAME"]
-    )
+    annotated["domain.name"] = annotated["domain"].map(domain_names)
+    annotated["domain.first.level.name"] = annotated["domain.first.level"].map(domain_names)
+    annotated["domain.second.level.name"] = annotated["domain.two.levels"].map(domain_names)
+    annotated["domain.third.level.name"] = annotated["domain.three.levels"].map(domain_names)
     
-    annotated["domain.first.level.name"] = annotated["domain.first.level"].map(
-        cath_names_unique.set_index("CATH_ID")["NAME"]
-    )
+    return annotated
 
-    annotated["domain.second.level.name"] = annotated["domain.two.levels"].map(
-        cath_names_unique.set_index("CATH_ID")["NAME"]
+# Counts every domain level, with and without gene deduplication, in a
+# single DuckDB scan of the input TSV.
+DOMAIN_COUNTS_QUERY = """
+    WITH levels AS (
+        SELECT
+            gene,
+            cath_label AS d0,
+            NULLIF(string_split(cath_label, '.')[1], '') AS d1,
+            NULLIF(array_to_string(list_filter(string_split(cath_label, '.')[1:2], x -> x <> ''), '.'), '') AS d2,
+            NULLIF(array_to_string(list_filter(string_split(cath_label, '.')[1:3], x -> x <> ''), '.'), '') AS d3
+        FROM (
+            SELECT
+                NULLIF(regexp_extract(ted_id, 'AF-(.*)-F1', 1), '') AS gene,
+                cath_label
+            FROM read_csv_auto(?, delim='\t', header=True, types={'ted_id': 'VARCHAR', 'cath_label': 'VARCHAR'})
+            WHERE cath_label <> '-'
+        )
+        WHERE gene IS NOT NULL
+    ),
+    grouped AS (
+        SELECT
+            CASE
+                WHEN GROUPING(d0) = 0 THEN 0
+                WHEN GROUPING(d1) = 0 THEN 1
+                WHEN GROUPING(d2) = 0 THEN 2
+                ELSE 3
+            END AS level,
+            COALESCE(d0, d1, d2, d3) AS domain,
+            COUNT(*) AS n,
+            COUNT(DISTINCT gene) AS n_dedup
+        FROM levels
+        GROUP BY GROUPING SETS ((d0), (d1), (d2), (d3))
     )
-
-    annotated["domain.third.level.name"] = annotated["domain.three.levels"].map(
-        cath_names_unique.set_index("CATH_ID")["NAME"]
+    SELECT domain, count, level, dedup FROM (
+        SELECT domain, n AS count, level, 0 AS dedup FROM grouped WHERE domain IS NOT NULL
+        UNION ALL
+        SELECT domain, n_dedup AS count, level, 1 AS dedup FROM grouped WHERE domain IS NOT NULL
     )
-    
-    return annotated
+    ORDER BY level, dedup, count DESC, domain
+"""
 
 def analyze_ted_summary(input_tsv, output_tsv=None):
-    df = pd.read_csv(input_tsv, sep="\t")
-    
-    df = df[df["cath_label"] != "-"]
-    df["gene"] = df["ted_id"].str.extract(r"AF-(.*)-F1")
-    df["domain"] = df["cath_label"]
-
-    df = extract_domain_levels(df)
-
     domain_cols = ["domain", "domain.first.level", "domain.two.levels", "domain.three.levels"]
-    results = []
 
-    for col in domain_cols:
-        for dedup in [False, True]:
-            counts = count_domains(df, col, unique_gene=dedup)
-            counts["domain.type"] = col
-            counts["deduplicated"] = "deduped" if dedup else ""
-            results.append(counts)
+    con = duckdb.connect()
+    combined = con.execute(DOMAIN_COUNTS_QUERY, [str(input_tsv)]).df()
+    con.close()
 
-    combined = pd.concat(results, ignore_index=True)
+    combined["domain.type"] = combined["level"].map(dict(enumerate(domain_cols)))
+    combined["deduplicated"] = combined["dedup"].map({0: "", 1: "deduped"})
+    combined = combined[["domain", "count", "domain.type", "deduplicated"]]
 
     annotated = annotate_domains(combined)
     
     if output_tsv:
         annotated.to_csv(output_tsv, sep="\t", index=False)
         print(f"Saved annotated domain counts to {output_tsv}")
-    return annotated
\ No newline at end of file
+    return annotated
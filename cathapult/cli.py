@@ -1,8 +1,12 @@
 import argparse
+import duckdb
+import json
 import os
-import pandas as pd
+import tempfile
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from pathlib import Path
-from .fetcher import fetch_ted_summary, filter_ted_summary
+from .fetcher import fetch_ted_summaries, filter_ted_summary, filter_ted_summary_duckdb
 from .analyze import analyze_ted_summary
 from .enrichment import calculate_odds_ratio, plot_odds_ratio
 from .db import create_db, query_by_uniprot_ids, query_excluding_uniprot_ids
@@ -17,6 +21,89 @@ def check_db_env(gzipped_file):
         )
     return(gzipped_file)
 
+def read_uniprot_ids(path):
+    """Read whitespace-separated UniProt IDs (normally one per line) in a single buffered read."""
+    with open(path, buffering=1 << 20) as f:
+        return f.read().split()
+
+def load_group_tsv(path, filter_column=None, filter_values=None):
+    """Read a group TSV through DuckDB, applying the row filters during the scan."""
+    # Only the columns the odds ratio uses are kept, and everything is read as text
+    # so no column's type sniffing can fail on a later value.
+    # Rows without a CATH assignment never reach the odds ratio, so skip them at read time
+    query = """
+        SELECT cath_label, uniprot_acc
+        FROM read_csv_auto(?, delim='\t', header=True, all_varchar=true)
+        WHERE cath_label <> '-'
+    """
+    params = [str(path)]
+    if filter_column and filter_values:
+        column = filter_column.replace('"', '""')
+        query += f' AND "{column}" IN (SELECT unnest(?))'
+        params.append(list(filter_values))
+
+    con = duckdb.connect()
+    df = con.execute(query, params).df()
+    con.close()
+    return df
+
+FETCH_WRITE_BATCH_SIZE = 1000
+
+def batched_records(results, batch_size):
+    """Regroup per-ID record lists into batches of at least batch_size records."""
+    batch = []
+    for records in results:
+        batch.extend(records)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def records_schema(records):
+    """Schema over the union of all records' keys, in first-seen order, typed per key."""
+    # pa.Table.from_pylist would take its columns from the first record only
+    keys = list(dict.fromkeys(key for record in records for key in record))
+    return pa.schema([
+        pa.field(key, pa.array([record.get(key) for record in records]).type) for key in keys
+    ])
+
+def spool_records(batches, spool):
+    """
+    Write every record to spool as a JSON line and return a schema that fits all batches.
+    Like pd.DataFrame(records): keys are kept in first-seen order, int columns that
+    later see floats become float64, and all-null columns become strings.
+    """
+    schemas = []
+    n_rows = 0
+    try:
+        for batch in batches:
+            spool.writelines(json.dumps(record) + "\n" for record in batch)
+            schemas.append(records_schema(batch))
+            n_rows += len(batch)
+        if not schemas:
+            return None, 0
+        schema = pa.unify_schemas(schemas, promote_options="permissive")
+    except (pa.ArrowTypeError, pa.ArrowInvalid) as e:
+        raise ValueError(f"Fetched records have conflicting field types: {e}") from e
+    schema = pa.schema([
+        field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+        for field in schema
+    ])
+    return schema, n_rows
+
+def read_spooled_batches(spool, batch_size):
+    """Yield lists of records back from a JSON-lines spool, batch_size at a time."""
+    spool.seek(0)
+    batch = []
+    for line in spool:
+        batch.append(json.loads(line))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 def cli_fetch(args):
     """Handler for the 'fetch' command."""
     if args.output_file:
@@ -30,17 +117,27 @@ def cli_fetch(args):
         os.makedirs(output_dir)
         print(f"Created output directory: {output_dir}")
 
-    with open(args.input_file) as f:
-        uniprot_ids = [line.strip() for line in f if line.strip()]
+    uniprot_ids = read_uniprot_ids(args.input_file)
 
-    print(f"Fetching domain summaries for {len(uniprot_ids)} UniProt IDs...")
-    all_data = [data for uid in uniprot_ids for data in fetch_ted_summary(uid, delay=0.1)]
+    print(f"Fetching domain summaries for {len(uniprot_ids)} UniProt IDs using {args.workers} workers...")
+    # Records are spooled to a temporary file as they arrive so memory stays bounded;
+    # the TSV is written once every batch has been seen, so its columns and types
+    # cover all records and a type conflict fails before any output is written
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+        results = fetch_ted_summaries(uniprot_ids, max_workers=args.workers)
+        schema, n_rows = spool_records(
+            batched_records(results, batch_size=FETCH_WRITE_BATCH_SIZE), spool
+        )
+        if schema is None:
+            print("No data fetched.")
+            return
+        with pacsv.CSVWriter(
+            output_file, schema, write_options=pacsv.WriteOptions(delimiter="\t")
+        ) as writer:
+            for batch in read_spooled_batches(spool, FETCH_WRITE_BATCH_SIZE):
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
 
-    if all_data:
-        pd.DataFrame(all_data).to_csv(output_file, sep="\t", index=False)
-        print(f"Results saved to: {output_file}")
-    else:
-        print("No data fetched.")
+    print(f"Saved {n_rows} rows to: {output_file}")
 
 def cli_analyze(args):
     """Handler for the 'analyze' command."""
@@ -48,16 +145,16 @@ def cli_analyze(args):
 
 def cli_odds_ratio(args):
     """Handler for the 'odds-ratio' command."""
+    filter_column = filter_values = None
+    if args.filter_column and args.filter_values:
+        print(f"Filtering data on column '{args.filter_column}' with values: {args.filter_values}")
+        filter_column, filter_values = args.filter_column, args.filter_values
+
     print(f"Loading group 1 data from: {args.group1_file}")
-    df1 = pd.read_csv(args.group1_file, sep='\t')
+    df1 = load_group_tsv(args.group1_file, filter_column, filter_values)
     
     print(f"Loading group 2 data from: {args.group2_file}")
-    df2 = pd.read_csv(args.group2_file, sep='\t')
-
-    if args.filter_column and args.filter_values:
-        print(f"Filtering data on column '{args.filter_column}' with values: {args.filter_values}")
-        df1 = df1[df1[args.filter_column].isin(args.filter_values)]
-        df2 = df2[df2[args.filter_column].isin(args.filter_values)]
+    df2 = load_group_tsv(args.group2_file, filter_column, filter_values)
     
     print(f"Calculating odds ratio...")
     results = calculate_odds_ratio(df1, df2, args.unique_features)
@@ -85,14 +182,23 @@ def cli_filter(args):
     print(f"Filtering '{gzipped_file}' using UniProt IDs from '{args.uniprot_ids}'...")
     
     uniprot_id_file = args.uniprot_ids
-    with open(uniprot_id_file) as f:
-        uniprot_ids = set(line.strip() for line in f if line.strip())
+    uniprot_ids = set(read_uniprot_ids(uniprot_id_file))
     
-    df = filter_ted_summary(
-        target_ids=uniprot_ids,
-        ted_db_gz=gzipped_file,
-        filter_keyword=args.keyword
-    )
+    # CATHAPULT_BACKEND=duckdb streams the file through DuckDB instead of the Python line scan
+    if os.getenv("CATHAPULT_BACKEND", "").lower() == "duckdb":
+        df = filter_ted_summary_duckdb(
+            target_ids=uniprot_ids,
+            ted_db_gz=gzipped_file,
+            filter_keyword=args.keyword
+        )
+    else:
+        df = filter_ted_summary(
+            target_ids=uniprot_ids,
+            ted_db_gz=gzipped_file,
+            filter_keyword=args.keyword,
+            processes=args.processes,
+            gzip_index=args.gzip_index
+        )
     print(f"Filtered {len(df)} rows.")
 
     if args.output_file:
@@ -107,15 +213,17 @@ def cli_setup_db(args):
     """Handler for setting up the local DB."""
     db_path = str(Path(db_path).with_suffix(".duckdb"))
     print(f"Creating database at: {db_path}")
-    create_db(tsv_gz_path=args.tsv_gz_file, db_path=db_path, overwrite=args.overwrite)
+    create_db(
+        tsv_gz_path=args.tsv_gz_file, db_path=db_path, overwrite=args.overwrite,
+        threads=args.threads, memory_limit=args.memory_limit, temp_directory=args.temp_directory
+    )
     print("Database creation completed.")
 
 def cli_query_db(args):
     """Handler for querying the DB using UniProt IDs."""
     db_path = check_db_env(args.db_path)
     
-    with open(args.uniprot_ids) as f:
-        uniprot_ids = [line.strip() for line in f if line.strip()]
+    uniprot_ids = read_uniprot_ids(args.uniprot_ids)
     
     db_path = str(Path(db_path).with_suffix(".duckdb"))
     
@@ -148,6 +256,10 @@ def main():
     fetch_parser = subparsers.add_parser("fetch", help="Fetch CATH-TED domain summaries from UniProt IDs")
     fetch_parser.add_argument("input_file", help="Text file with UniProt IDs (one per line)")
     fetch_parser.add_argument("output_file", nargs="?", help="Optional output TSV path (default: <input_name>.tsv)")
+    fetch_parser.add_argument(
+        "--workers", type=int, default=16,
+        help="Number of concurrent fetch requests (default: 16)"
+    )
     fetch_parser.set_defaults(func=cli_fetch)
 
     # Analyze subcommand
@@ -202,6 +314,14 @@ def main():
     filter_parser.add_argument(
         "output_file", help="Output TSV file to save the filtered result"
     )
+    filter_parser.add_argument(
+        "--processes", type=int, default=1,
+        help="Scan the file in this many worker processes (gzip input needs rapidgzip; default: 1)"
+    )
+    filter_parser.add_argument(
+        "--gzip_index",
+        help="rapidgzip index for the parallel scan; built here if missing and reused on later runs"
+    )
     filter_parser.set_defaults(func=cli_filter)
     
     # Setup-db subcommand
@@ -213,6 +333,9 @@ def main():
     )
     setup_parser.add_argument("--db_path", help="Output DB file path (default: same name with .duckdb)")
     setup_parser.add_argument("--overwrite", action='store_true', help="Optional flag to overwrite existing database")
+    setup_parser.add_argument("--threads", type=int, help="DuckDB worker threads for ingest (default: all CPUs)")
+    setup_parser.add_argument("--memory_limit", help="DuckDB memory limit for ingest (e.g., '16GB')")
+    setup_parser.add_argument("--temp_directory", help="Directory DuckDB may spill to during ingest")
     setup_parser.set_defaults(func=cli_setup_db)
 
     # Query subcommand
@@ -5,6 +5,7 @@ import gzip
 import re
 import os
 from typing import List, Optional
+from .fetcher import TED_COLUMN_TYPES
 
 DB_SCHEMA = """
 CREATE TABLE IF NOT EXISTS domain_summary (
@@ -33,11 +34,17 @@ CREATE TABLE IF NOT EXISTS domain_summary (
 );
 """
 
+# Matches 6 to 10 character UniProt accession (uppercase letters/digits, excluding 'O' and 'Q')
+UNIPROT_RE = re.compile(r"[A-NR-Z0-9]{6,10}")
+
 def extract_uniprot(ted_id: str) -> str:
-    # Matches 6 to 10 character UniProt accession (uppercase letters/digits, excluding 'O' and 'Q')
-    match = re.search(r"[A-NR-Z0-9]{6,10}", ted_id)
+    match = UNIPROT_RE.search(ted_id)
     return match.group(0) if match else ""
 
+def extract_uniprot_series(ted_ids: pd.Series) -> pd.Series:
+    # Vectorized extract_uniprot for a whole column of TED IDs
+    return ted_ids.str.extract(f"({UNIPROT_RE.pattern})", expand=False).fillna("")
+
 def get_db_path(tsv_path: str, db_path: Optional[str] = None) -> Path:
     tsv_path = Path(tsv_path)
     return Path(db_path) if db_path else tsv_path.with_suffix(".duckdb")
@@ -45,7 +52,20 @@ def get_db_path(tsv_path: str, db_path: Optional[str] = None) -> Path:
 def db_exists(db_path: Path) -> bool:
     return db_path.exists()
 
-def create_db(tsv_gz_path: str, db_path: str = None, overwrite: bool = False) -> Path:
+def configure_ingest(con, threads: Optional[int] = None, memory_limit: Optional[str] = None,
+    temp_directory: Optional[str] = None) -> None:
+    # Pin the thread count explicitly; DuckDB's detected default can be low on CI/cloud hosts
+    con.execute("SET threads = ?", [threads or os.cpu_count() or 1])
+    con.execute("SET enable_progress_bar = false")
+    if memory_limit:
+        con.execute("SET memory_limit = ?", [memory_limit])
+    if temp_directory:
+        # Spill location for larger-than-memory ingest
+        con.execute("SET temp_directory = ?", [str(temp_directory)])
+
+def create_db(tsv_gz_path: str, db_path: str = None, overwrite: bool = False,
+    threads: Optional[int] = None, memory_limit: Optional[str] = None,
+    temp_directory: Optional[str] = None) -> Path:
     tsv_gz_path = str(tsv_gz_path)
     db_path = str(db_path or Path(tsv_gz_path).with_suffix(".duckdb"))
 
@@ -57,27 +77,11 @@ def create_db(tsv_gz_path: str, db_path: str = None, overwrite: bool = False) ->
         os.remove(db_path)
 
     con = duckdb.connect(db_path)
+    configure_ingest(con, threads, memory_limit, temp_directory)
 
-    # Step 1: Define ALL column names for the source file IN ORDER
-    # This is crucial for correctly parsing the header-less file.
-    all_column_names = [
-        "ted_id", "md5_domain", "consensus_level", "chopping", "nres_domain", "num_segments",
-        "plddt", "num_helix_strand_turn", "num_helix", "num_strand", "num_helix_strand", "num_turn",
-        "proteome-id", "cath_label", "cath_assignment_level", "cath_assignment_method",
-        "packing_density", "norm_rg", "tax_common_name", "tax_scientific_name", "tax_lineage"
-    ]
-    
-    # Define the data types for the columns you are loading.
-    # This is still a best practice for performance.
-    full_column_types = {
-        "ted_id": "VARCHAR", "md5_domain": "VARCHAR", "consensus_level": "VARCHAR",
-        "chopping": "VARCHAR", "nres_domain": "INTEGER", "num_segments": "INTEGER",
-        "plddt": "FLOAT", "num_helix_strand_turn": "INTEGER", "num_helix": "INTEGER",
-        "num_strand": "INTEGER", "num_helix_strand": "INTEGER", "num_turn": "INTEGER",
-        "proteome-id": "VARCHAR", "cath_label": "VARCHAR", "cath_assignment_level": "VARCHAR",
-        "cath_assignment_method": "VARCHAR", "packing_density": "FLOAT", "norm_rg": "FLOAT",
-        "tax_common_name": "VARCHAR", "tax_scientific_name": "VARCHAR", "tax_lineage": "VARCHAR"
-    }
+    # Step 1: Column names and types of the header-less source file, in file order.
+    # Declaring them up front avoids type sniffing and is best for performance.
+    full_column_types = TED_COLUMN_TYPES
 
     # Step 2: Use read_csv with header=False and provide the names list.
     # Then select the subset of columns you want for your final table.
@@ -104,7 +108,7 @@ def create_db(tsv_gz_path: str, db_path: str = None, overwrite: bool = False) ->
             compression='gzip'
         )
     """, [tsv_gz_path, full_column_types])
-    
+
     con.close()
     print(f"Slim DB created from header-less TSV at {db_path}")
     return Path(db_path)
@@ -112,16 +116,25 @@ def create_db(tsv_gz_path: str, db_path: str = None, overwrite: bool = False) ->
 
 def query_by_uniprot_ids(db_path: str, uniprot_ids: List[str], keyword: Optional[str] = None, 
     tax_id: Optional[int] = None) -> pd.DataFrame:
-    con = duckdb.connect(db_path)
-    id_list_str = ', '.join(f"'{id}'" for id in uniprot_ids)
-    query = f"""
-        SELECT * FROM domain_summary
-        WHERE uniprot_acc IN ({id_list_str})
+    con = duckdb.connect(str(db_path), read_only=True)
+
+    # Register the ID list as a virtual table and semi-join against it,
+    # rather than inlining every ID as a literal in the SQL text
+    ids_df = pd.DataFrame({'uniprot_acc': list(uniprot_ids)})
+    con.register('include_list', ids_df)
+
+    query = """
+        SELECT main.* FROM domain_summary main
+        SEMI JOIN include_list inc
+            ON main.uniprot_acc = inc.uniprot_acc
+        WHERE TRUE
     """
-    if keyword:
-        query += f" AND tax_common_name ILIKE '%{keyword}%'"
 
     params = []
+    if keyword:
+        query += " AND main.tax_common_name ILIKE ?"
+        params.append(f"%{keyword}%")
+
     if tax_id:
         # Integer comparison is extremely fast
         query += " AND main.tax_id = ?"
@@ -1,17 +1,23 @@
 import pandas as pd
 import numpy as np
 from .analyze import extract_domain_levels, annotate_domains, deep_annotate_domains
-from scipy.stats import fisher_exact
-from statsmodels.stats.multitest import multipletests
-import matplotlib.pyplot as plt
+from scipy.stats import hypergeom
+try:
+    from scipy.stats import false_discovery_control
+except ImportError:  # SciPy < 1.11
+    false_discovery_control = None
+import matplotlib.style
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def collapse_domain_levels(df):
+def collapse_domain_levels(df, unique_features=False):
     """
     Optimized: Uses vectorized melting instead of manual iteration.
+    With unique_features, each (domain, protein) pair is kept once per level.
     """
     df = df[df["cath_label"] != "-"].copy()
     df["domain"] = df["cath_label"]
@@ -19,13 +25,23 @@ def collapse_domain_levels(df):
     
     domain_cols = ["domain.first.level", "domain.two.levels", "domain.three.levels", "domain"]
     
-    # Vectorized reshape (melt) is significantly faster than iterrows
-    df_features = df.melt(
+    if unique_features:
+        # Dedupe per level before stacking rather than stacking 4x rows and deduping after
+        df_features = pd.concat([
+            df[[col, 'uniprot_acc']].drop_duplicates().rename(columns={col: 'domain'}).assign(level=i)
+            for i, col in enumerate(domain_cols)
+        ], ignore_index=True)
+        return df_features[['domain', 'level', 'uniprot_acc']]
+    
+    # Vectorized reshape (melt) is significantly faster than iterrows.
+    # Melt only the needed columns; value_name may not reuse an existing column
+    # name ("domain"), so rename afterwards
+    df_features = df[['uniprot_acc'] + domain_cols].melt(
         id_vars=['uniprot_acc'], 
         value_vars=domain_cols, 
         var_name='level_name', 
-        value_name='domain'
-    )
+        value_name='domain_value'
+    ).rename(columns={'domain_value': 'domain'})
     
     # Map level names back to numeric indices for compatibility
     level_map = {col: i for i, col in enumerate(domain_cols)}
@@ -33,104 +49,149 @@ def collapse_domain_levels(df):
     
     return df_features[['domain', 'level', 'uniprot_acc']]
 
+def bh_adjust(p_values):
+    """
+    Benjamini-Hochberg adjusted p-values (same as multipletests(method='fdr_bh')).
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    if false_discovery_control is not None:
+        return false_discovery_control(p_values, method='bh')
+    # Step-up from the largest p-value: p * n / rank, then a running minimum
+    n = len(p_values)
+    order = np.argsort(p_values)[::-1]
+    adjusted = np.minimum.accumulate(p_values[order] * n / np.arange(n, 0, -1))
+    result = np.empty(n)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result
+
+def fisher_exact_2x2(a, b, c, d):
+    """
+    Vectorized two-sided Fisher's exact test over many [[a, b], [c, d]] tables.
+    Mirrors scipy.stats.fisher_exact: sample odds ratio, and a p-value summing
+    every table no more likely than the observed one. The far-side cutoff is
+    found with a bisection run on all tables at once.
+    """
+    a, b, c, d = (np.asarray(x, dtype=np.int64) for x in (a, b, c, d))
+    M, n, N = a + b + c + d, a + b, a + c  # population, row-1 total, column-1 total
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        odds_ratio = np.where((b > 0) & (c > 0), (a * d) / (b * c), np.inf)
+
+    pmf = lambda x: hypergeom.pmf(x, M, n, N)
+    mode = ((N + 1) * (n + 1)) // (M + 2)
+    p_exact = pmf(a)
+    p_mode = pmf(mode)
+    threshold = p_exact * (1 + 1e-14)
+
+    below = a < mode
+    # Below the mode the far tail starts at the first x in [mode, N] with pmf(x) < threshold;
+    # above it, it ends at the last x in [0, mode] with pmf(x) <= threshold
+    lo = np.where(below, mode, 0)
+    hi = np.where(below, N + 1, mode + 1)
+    for _ in range(int(np.max(M, initial=0)).bit_length() + 1):
+        active = lo < hi
+        if not active.any():
+            break
+        mid = (lo + hi) // 2
+        p_mid = pmf(mid)
+        go_left = np.where(below, p_mid < threshold, p_mid > threshold) & active
+        hi = np.where(go_left, mid, hi)
+        lo = np.where(~go_left & active, mid + 1, lo)
+
+    p_value = np.where(
+        below,
+        hypergeom.cdf(a, M, n, N) + hypergeom.sf(lo - 1, M, n, N),
+        hypergeom.sf(a - 1, M, n, N) + hypergeom.cdf(lo - 1, M, n, N),
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        at_mode = np.abs(p_exact - p_mode) / np.maximum(p_exact, p_mode) <= 1e-14
+    p_value = np.minimum(np.where(at_mode, 1.0, p_value), 1.0)
+
+    # An empty row or column carries no information
+    degenerate = (n == 0) | (c + d == 0) | (N == 0) | (b + d == 0)
+    odds_ratio = np.where(degenerate, np.nan, odds_ratio)
+    p_value = np.where(degenerate, 1.0, p_value)
+    return odds_ratio, p_value
+
 def calculate_odds_ratio(df1, df2, unique_features=False, min_count=5):
     """
-    Optimized: Uses value counts pre-calculation and threshold filtering.
+    Optimized: Counts each level once and tests every feature in one vectorized pass.
     """
-    df1_features = collapse_domain_levels(df1)
-    df2_features = collapse_domain_levels(df2)
-    
-    if unique_features:
-        df1_features = df1_features.drop_duplicates(subset=['domain','uniprot_acc'])
-        df2_features = df2_features.drop_duplicates(subset=['domain','uniprot_acc'])
-    
+    df1_features = collapse_domain_levels(df1, unique_features)
+    df2_features = collapse_domain_levels(df2, unique_features)
     
     # Combine unique features
-    all_results = pd.DataFrame()
+    all_results = []
     
     for level in [0, 1, 2, 3]:
-        results = []
         df1_features_level = df1_features[df1_features['level'] == level]
         df2_features_level = df2_features[df2_features['level'] == level]
 
-        # Pre-calculate counts once
-        counts1 = df1_features_level['domain'].value_counts()
-        counts2 = df2_features_level['domain'].value_counts()
-
-        all_features = set(counts1.index) | set(counts2.index)
-        
         total_group1 = len(df1_features_level)
         total_group2 = len(df2_features_level)
 
-        for feature in all_features:
-            a = counts1.get(feature, 0)
-            c = counts2.get(feature, 0)
-            
-            b = total_group1 - a
-            d = total_group2 - c
-
-            # --- NEW: Skip rare levels ---
-            if a < min_count or c < 1:
-                results.append({
-                    'feature': feature,
-                    'grp1_count': a, 'grp1_total': total_group1,
-                    'grp2_count': c, 'grp2_total': total_group2,
-                    'odds.ratio': np.nan,
-                    'log.odds.ratio': np.nan,
-                    'p.value': np.nan,
-                    'ci.lower': np.nan,
-                    'ci.upper': np.nan,
-                    'domain': feature,
-                    'domain.level': level+1,
-                })
-                continue
-                
-            # Contingency table calculation
-            odds_ratio, p_value = fisher_exact([[a, b], [c, d]])
-            
-            # Handling Confidence Intervals
-            if a == 0 or b == 0 or c == 0 or d == 0:
-                ci_lower, ci_upper = np.nan, np.nan
-            else:
-                # Woolf's method
-                log_or = np.log(odds_ratio)
-                se_log_or = np.sqrt(1/a + 1/b + 1/c + 1/d)
-                ci_lower = np.exp(log_or - 1.96 * se_log_or)
-                ci_upper = np.exp(log_or + 1.96 * se_log_or)
-
-            results.append({
-                'feature': feature,
-                'grp1_count': a, 'grp1_total': total_group1,
-                'grp2_count': c, 'grp2_total': total_group2,
-                'odds.ratio': odds_ratio,
-                'log.odds.ratio': np.log2(odds_ratio) if odds_ratio > 0 else -np.inf,
-                'p.value': p_value,
-                'ci.lower': np.log2(ci_lower) if not np.isnan(ci_lower) else np.nan,
-                'ci.upper': np.log2(ci_upper) if not np.isnan(ci_upper) else np.nan,
-                'domain': feature,
-                'domain.level': level+1,
-            })
-
-        results_df = pd.DataFrame(results)
+        # Integer-encode both groups against one shared (sorted) feature index,
+        # then count each group with a single bincount; missing domains get code -1
+        codes, all_features = pd.factorize(
+            pd.concat([df1_features_level['domain'], df2_features_level['domain']], ignore_index=True),
+            sort=True,
+        )
+        if len(all_features) == 0:
+            continue
+        codes1, codes2 = codes[:total_group1], codes[total_group1:]
+
+        a = np.bincount(codes1[codes1 >= 0], minlength=len(all_features))
+        c = np.bincount(codes2[codes2 >= 0], minlength=len(all_features))
+        b = total_group1 - a
+        d = total_group2 - c
+
+        # --- NEW: Skip rare levels ---
+        tested = (a >= min_count) & (c >= 1)
+
+        # Contingency table calculation, only for the tables that are actually tested
+        odds_ratio = np.full(len(all_features), np.nan)
+        p_value = np.full(len(all_features), np.nan)
+        odds_ratio[tested], p_value[tested] = fisher_exact_2x2(a[tested], b[tested], c[tested], d[tested])
+
+        # Woolf's method confidence intervals, undefined when any cell is empty.
+        # The bounds are reported in log2 space, so scale the natural-log interval
+        # directly instead of round-tripping through exp
+        with np.errstate(divide='ignore', invalid='ignore'):
+            se_log_or = np.sqrt(1/a + 1/b + 1/c + 1/d)
+            log_or = np.log(odds_ratio)
+            has_ci = tested & (a > 0) & (b > 0) & (c > 0) & (d > 0)
+            ci_lower = np.where(has_ci, (log_or - 1.96 * se_log_or) / np.log(2), np.nan)
+            ci_upper = np.where(has_ci, (log_or + 1.96 * se_log_or) / np.log(2), np.nan)
+            log2_or = np.where(odds_ratio > 0, np.log2(odds_ratio), -np.inf)
+
+        results_df = pd.DataFrame({
+            'feature': all_features,
+            'grp1_count': a, 'grp1_total': total_group1,
+            'grp2_count': c, 'grp2_total': total_group2,
+            'odds.ratio': odds_ratio,
+            'log.odds.ratio': np.where(tested, log2_or, np.nan),
+            'p.value': p_value,
+            'ci.lower': ci_lower,
+            'ci.upper': ci_upper,
+            'domain': all_features,
+            'domain.level': level+1,
+        })
         
-        if not results_df.empty:
-            p_values = results_df['p.value']
-            valid_idx = p_values.notna()
-
-            # Initialize p.adj with NaN
-            results_df['p.adj'] = np.nan
-
-            if valid_idx.sum() > 0:
-                _, p_adj, _, _ = multipletests(
-                    p_values[valid_idx],
-                    method='fdr_bh'
-                )
-                results_df.loc[valid_idx, 'p.adj'] = p_adj
-
-            results_df = deep_annotate_domains(results_df)
-            all_results = all_results.append(results_df)
+        p_values = results_df['p.value']
+        valid_idx = p_values.notna()
+
+        # Initialize p.adj with NaN
+        results_df['p.adj'] = np.nan
+
+        if valid_idx.sum() > 0:
+            results_df.loc[valid_idx, 'p.adj'] = bh_adjust(p_values[valid_idx])
+
+        # Annotate per level: level columns deeper than this level's features stay NaN
+        all_results.append(deep_annotate_domains(results_df))
             
-    return all_results
+    if not all_results:
+        return pd.DataFrame()
+    return pd.concat(all_results)
 
 def plot_odds_ratio(results_df, output_plot, alpha=0.05):
     """
@@ -141,29 +202,40 @@ def plot_odds_ratio(results_df, output_plot, alpha=0.05):
     results_df['y.labels'] = results_df['feature'] + ' ' + results_df['domain.name']
     results_df = results_df.dropna()
     
-    plt.style.use('seaborn-v0_8-whitegrid')
-    fig, ax = plt.subplots(figsize=(10, max(6, len(results_df) * 0.275)))
-    
-    colors = {True: '#d62728', False: 'grey'} # Red for significant, grey for not
-    
-    # Plot confidence intervals
-    for _, row in results_df.iterrows():
-        ax.plot([row['ci.lower'], row['ci.upper']], [row['y.labels'], row['y.labels']], 'k-', lw=1, zorder=1)
-    
+    # A standalone Figure saves straight to file without going through pyplot,
+    # so importing this module never touches the global backend or figure state
+    with matplotlib.style.context('seaborn-v0_8-whitegrid'):
+        fig = Figure(figsize=(10, max(6, len(results_df) * 0.275)))
+        ax = fig.subplots()
+        
+        colors = {True: '#d62728', False: 'grey'} # Red for significant, grey for not
+        
+        # One row per feature, labelled explicitly below
+        y = np.arange(len(results_df))
 
-    # Plot odds ratio points
-    ax.scatter(results_df['log.odds.ratio'], results_df['y.labels'], 
-               c=results_df['significant'].map(colors),
-               s=60, zorder=2, edgecolors='black', linewidths=0.7)
-
-    ax.axvline(x=1, color='black', linestyle='--', lw=1)
-    #ax.set_xscale('log2')
-    ax.set_xlabel('Odds Ratio (log2 scale)\n(Group 1 vs Group 2)', fontsize=12)
-    ax.set_ylabel('Feature', fontsize=12)
-    ax.set_title('Feature Enrichment Odds Ratio', fontsize=14, weight='bold')
-    ax.tick_params(axis='both', which='major', labelsize=10)
-    
-    plt.tight_layout()
-    plt.subplots_adjust(left=0.3, right=0.98, top=0.95, bottom=0.15)
-    plt.savefig(output_plot, dpi=300, bbox_inches='tight')
+        # Plot confidence intervals as a single collection rather than one line per feature
+        segments = np.stack([
+            np.column_stack([results_df['ci.lower'].to_numpy(), y]),
+            np.column_stack([results_df['ci.upper'].to_numpy(), y]),
+        ], axis=1)
+        ax.add_collection(LineCollection(segments, colors='k', linewidths=1, zorder=1, rasterized=True))
+
+        # Plot odds ratio points
+        ax.scatter(results_df['log.odds.ratio'], y, 
+                   c=results_df['significant'].map(colors),
+                   s=60, zorder=2, edgecolors='black', linewidths=0.7, rasterized=True)
+        ax.set_yticks(y)
+        ax.set_yticklabels(results_df['y.labels'])
+        ax.autoscale_view()
+
+        ax.axvline(x=1, color='black', linestyle='--', lw=1)
+        #ax.set_xscale('log2')
+        ax.set_xlabel('Odds Ratio (log2 scale)\n(Group 1 vs Group 2)', fontsize=12)
+        ax.set_ylabel('Feature', fontsize=12)
+        ax.set_title('Feature Enrichment Odds Ratio', fontsize=14, weight='bold')
+        ax.tick_params(axis='both', which='major', labelsize=10)
+        
+        fig.tight_layout()
+        fig.subplots_adjust(left=0.3, right=0.98, top=0.95, bottom=0.15)
+        fig.savefig(output_plot, dpi=300, bbox_inches='tight')
     logging.info(f"📊 Plot saved to {output_plot}")
\ No newline at end of file
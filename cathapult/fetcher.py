@@ -1,18 +1,53 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 import gzip
+import duckdb
+import numpy as np
 import pandas as pd
-from io import StringIO
 from tqdm import tqdm
 
+try:
+    import rapidgzip  # optional: parallel gzip decompression
+except ImportError:
+    rapidgzip = None
 
-def fetch_ted_summary(uniprot_id, timeout=10, delay=1):
-    url = f"https://ted.cathdb.info/api/v1/uniprot/summary/{uniprot_id}?skip=0&limit=100"
+
+def make_session(pool_size):
+    """
+    requests.Session whose connection pool holds pool_size keep-alive connections,
+    so that many concurrent callers can each reuse one (no TLS handshake per ID).
+    Throttling and transient server errors are retried with exponential backoff.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=1, pool_maxsize=pool_size,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)),
+    ))
+    return session
+
+# Shared by standalone fetch_ted_summary calls
+_SESSION = make_session(16)
+
+HEADERS = {"accept": "application/json"}
+URL_TMPL = "https://ted.cathdb.info/api/v1/uniprot/summary/{}?skip=0&limit=100"
+
+def fetch_ted_summary(uniprot_id, timeout=10, delay=0, session=None):
     try:
-        response = requests.get(url, headers={"accept": "application/json"}, timeout=timeout)
+        response = (session or _SESSION).get(URL_TMPL.format(uniprot_id), headers=HEADERS, timeout=timeout)
         response.raise_for_status()
         data = response.json().get("data", [])
-        time.sleep(delay)  # optional delay
+        if delay:
+            time.sleep(delay)  # optional delay
         return data
     except requests.exceptions.Timeout:
         print(f"Timeout for {uniprot_id}")
@@ -20,6 +55,17 @@ def fetch_ted_summary(uniprot_id, timeout=10, delay=1):
         print(f"Request failed for {uniprot_id}: {e}")
     return []
 
+def fetch_ted_summaries(uniprot_ids, max_workers=16, timeout=10, delay=0):
+    """Fetch many UniProt IDs concurrently, yielding each ID's records in input order."""
+    # Requests are network-bound, so a thread pool overlaps their round trips;
+    # each worker still waits `delay` after its own request. The session's pool
+    # matches the worker count so no worker's connection is discarded
+    with make_session(max_workers) as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(
+            lambda uid: fetch_ted_summary(uid, timeout=timeout, delay=delay, session=session),
+            uniprot_ids
+        )
+
 def get_ted_domains():
     path = os.getenv("DOMAIN_SUMMARY_FILE")
     if path is None:
@@ -34,18 +80,133 @@ def get_ted_domains():
 
 def extract_uniprot_id(model_id):
     """Extract UniProt ID from something like 'AF-A0A000-F1-model_v4_TED01'."""
-    parts = model_id.split('-')
-    if len(parts) >= 2:
-        return parts[1]
-    return None
+    # Slice between the first two '-' rather than splitting the whole ID
+    start = model_id.find('-')
+    if start < 0:
+        return None
+    end = model_id.find('-', start + 1)
+    return model_id[start + 1:] if end < 0 else model_id[start + 1:end]
     
-def open_maybe_gzip(path):
+class CommandPipe:
+    """Text (or bytes) stream over the stdout of a shell-style pipeline, e.g. `pigz -dc f | grep -F x`."""
+
+    def __init__(self, commands, binary=False, no_match_ok=False, source=None, env=None):
+        # no_match_ok: the last command is grep, which exits 1 when nothing matched
+        # source: binary file object fed to the first command's stdin from a thread
+        self.no_match_ok = no_match_ok
+        self.procs = []
+        self.feeder = self.feed_error = None
+        stdin = subprocess.PIPE if source is not None else None
+        for i, cmd in enumerate(commands):
+            last = i == len(commands) - 1
+            proc = subprocess.Popen(
+                cmd, stdin=stdin, stdout=subprocess.PIPE,
+                text=last and not binary, bufsize=1 << 20, env=env
+            )
+            if i == 0 and source is not None:
+                self.feeder = threading.Thread(target=self._feed, args=(source, proc.stdin), daemon=True)
+                self.feeder.start()
+            elif stdin is not None:
+                stdin.close()  # let the upstream process see SIGPIPE if we exit early
+            stdin = proc.stdout
+            self.procs.append(proc)
+        self.stream = self.procs[-1].stdout
+
+    def _feed(self, source, sink):
+        try:
+            with source, sink:
+                shutil.copyfileobj(source, sink, 1 << 20)
+        except BrokenPipeError:
+            pass  # the pipeline stopped reading early
+        except Exception as e:
+            self.feed_error = e
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def read(self, *args):
+        return self.stream.read(*args)
+
+    def close(self):
+        finished = self.procs[-1].poll() is not None or not self.stream.read(1)
+        self.stream.close()
+        for proc in self.procs:
+            if not finished and proc.poll() is None:
+                # Stopped early; don't leave the pipeline blocked on a full pipe
+                proc.terminate()
+            returncode = proc.wait()
+            allowed = (0, 1) if self.no_match_ok and proc is self.procs[-1] else (0,)
+            if finished and returncode not in allowed:
+                raise OSError(f"{proc.args[0]} exited with status {returncode}")
+        if self.feeder is not None:
+            self.feeder.join()
+            if finished and self.feed_error is not None:
+                raise OSError(f"Reading pipeline input failed: {self.feed_error}") from self.feed_error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def is_gzip(path):
     with open(path, 'rb') as f:
-        magic = f.read(2)
-    if magic == b'\x1f\x8b':  # gzip magic number
-        return gzip.open(path, 'rt')
-    else:
-        return open(path, 'r')
+        return f.read(2) == b'\x1f\x8b'  # gzip magic number
+
+def find_decompressor():
+    for tool in ("pigz", "gzip"):
+        exe = shutil.which(tool)
+        if exe:
+            return exe
+    return None
+
+def open_keyword_lines(path, keyword):
+    """Bytes stream of only the lines containing keyword, filtered by `grep -F`; None without grep."""
+    grep = shutil.which("grep")
+    if not grep or not keyword:
+        return None
+    # -a: never collapse the output to "binary file matches" on a stray NUL byte;
+    # LC_ALL=C: match raw bytes, so lines with invalid UTF-8 aren't skipped
+    grep_cmd = [grep, "-a", "-F", "-e", keyword]
+    env = dict(os.environ, LC_ALL="C")
+    if not is_gzip(path):
+        return CommandPipe([grep_cmd + [str(path)]], binary=True, no_match_ok=True, env=env)
+    if rapidgzip is not None:
+        # Parallel decompression in this process, piped into grep
+        source = rapidgzip.open(str(path), parallelization=os.cpu_count() or 1)
+        return CommandPipe([grep_cmd], binary=True, no_match_ok=True, source=source, env=env)
+    decompressor = find_decompressor()
+    if not decompressor:
+        return None
+    return CommandPipe([[decompressor, "-dc", str(path)], grep_cmd], binary=True, no_match_ok=True, env=env)
+
+def open_maybe_gzip(path, binary=False):
+    if not is_gzip(path):
+        return open(path, 'rb' if binary else 'r')
+
+    # Prefer parallel decompression; fall back to an external decompressor,
+    # which at least runs alongside the Python loop, then to stdlib gzip
+    if rapidgzip is not None:
+        raw = rapidgzip.open(str(path), parallelization=os.cpu_count() or 1)
+        buffered = io.BufferedReader(raw, buffer_size=1 << 20)
+        return buffered if binary else io.TextIOWrapper(buffered)
+    decompressor = find_decompressor()
+    if decompressor:
+        return CommandPipe([[decompressor, "-dc", str(path)]], binary=binary)
+    return gzip.open(path, 'rb' if binary else 'rt')
+
+def read_line_chunks(fin, chunk_size=1 << 22):
+    """Yield lists of complete lines (bytes, without newlines) read from fin in large chunks."""
+    tail = b''
+    while True:
+        chunk = fin.read(chunk_size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        yield lines
+    if tail:
+        yield [tail]
 
 TED_COLUMNS = [
     "ted_id", "md5_domain", "consensus_level", "chopping", "nres_domain",
@@ -55,30 +216,216 @@ TED_COLUMNS = [
     "norm_rg", "tax_common_name", "tax_scientific_name", "tax_lineage"
 ]
 
+TED_NUMERIC_COLUMNS = [
+    "nres_domain", "num_segments", "plddt", "num_helix_strand_turn", "num_helix",
+    "num_strand", "num_helix_strand", "num_turn", "packing_density", "norm_rg"
+]
+
+# Strings pd.read_csv treats as missing by default (its na_values list)
+READ_CSV_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+]
+
+# DuckDB types for the header-less TED summary, so reads never depend on type sniffing
+TED_COLUMN_TYPES = {
+    "ted_id": "VARCHAR", "md5_domain": "VARCHAR", "consensus_level": "VARCHAR",
+    "chopping": "VARCHAR", "nres_domain": "INTEGER", "num_segments": "INTEGER",
+    "plddt": "FLOAT", "num_helix_strand_turn": "INTEGER", "num_helix": "INTEGER",
+    "num_strand": "INTEGER", "num_helix_strand": "INTEGER", "num_turn": "INTEGER",
+    "proteome-id": "VARCHAR", "cath_label": "VARCHAR", "cath_assignment_level": "VARCHAR",
+    "cath_assignment_method": "VARCHAR", "packing_density": "FLOAT", "norm_rg": "FLOAT",
+    "tax_common_name": "VARCHAR", "tax_scientific_name": "VARCHAR", "tax_lineage": "VARCHAR"
+}
+
+# Few distinct values over many rows; stored as categoricals (integer codes)
+TED_CATEGORICAL_COLUMNS = [
+    "consensus_level", "cath_label", "cath_assignment_level", "cath_assignment_method",
+    "tax_common_name", "tax_scientific_name", "tax_lineage"
+]
+
+def match_ted_lines(lines, keyword, target_ids, rows, output_ids):
+    """Append the split fields and UniProt ID of every line with keyword and a target ID."""
+    for line in lines:
+        if keyword not in line:
+            continue
+        # Same rule as extract_uniprot_id, applied within the first column
+        col1_end = line.find(b'\t')
+        if col1_end < 0:
+            col1_end = len(line)
+        start = line.find(b'-', 0, col1_end)
+        if start < 0:
+            continue
+        end = line.find(b'-', start + 1, col1_end)
+        uniprot_id = line[start + 1:col1_end if end < 0 else end]
+        if uniprot_id in target_ids:
+            rows.append(line.rstrip(b'\r').decode().split('\t'))
+            output_ids.append(uniprot_id.decode())
+
+def read_range_line_chunks(fin, start, end, chunk_size=1 << 22):
+    """Like read_line_chunks, but only the lines of a seekable fin that start within [start, end)."""
+    # A line straddling `start` belongs to the previous range, which finishes it
+    if start > 0:
+        fin.seek(start - 1)
+        fin.readline()
+    else:
+        fin.seek(0)
+    pos = fin.tell()
+    tail = b''
+    while pos < end:
+        chunk = fin.read(min(chunk_size, end - pos))
+        if not chunk:
+            break
+        pos += len(chunk)
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        yield lines
+    if tail:
+        # The last line started before `end`; read on to its newline
+        yield [tail + fin.readline().rstrip(b'\n')]
+
+def build_gzip_index(path, index_path):
+    """Decompress path once with rapidgzip and export its seek-point index to index_path."""
+    with rapidgzip.RapidgzipFile(str(path), parallelization=os.cpu_count() or 1) as f:
+        f.seek(0, io.SEEK_END)
+        f.export_index(str(index_path))
+
+# Per-process state for the parallel scan, set once by the pool initializer
+_scan_state = {}
+
+def _init_scan_worker(path, index_path, keyword, target_ids):
+    if index_path is None:
+        fin = open(path, 'rb')
+    else:
+        fin = rapidgzip.RapidgzipFile(str(path), parallelization=1)
+        fin.import_index(str(index_path))
+    _scan_state.update(fin=fin, keyword=keyword, target_ids=target_ids)
+
+def _scan_range(byte_range):
+    rows, output_ids, n_lines = [], [], 0
+    for lines in read_range_line_chunks(_scan_state['fin'], *byte_range):
+        n_lines += len(lines)
+        match_ted_lines(lines, _scan_state['keyword'], _scan_state['target_ids'], rows, output_ids)
+    return rows, output_ids, n_lines
+
+def scan_ted_parallel(ted_db_gz, keyword, target_ids, processes, gzip_index=None, progress=None):
+    """
+    Split the decompressed file into byte ranges and scan them in worker processes.
+    Gzip input needs rapidgzip: its index lets every worker seek straight to its range.
+    The index is written to gzip_index (and reused if it already exists), otherwise
+    to a temporary file.
+    """
+    tmp_dir = None
+    index_path = None
+    if is_gzip(ted_db_gz):
+        index_path = gzip_index
+        if index_path is None:
+            tmp_dir = tempfile.mkdtemp(prefix="cathapult-")
+            index_path = os.path.join(tmp_dir, "index.gzidx")
+        if not os.path.exists(index_path):
+            build_gzip_index(ted_db_gz, index_path)
+        with rapidgzip.RapidgzipFile(str(ted_db_gz), parallelization=1) as f:
+            f.import_index(str(index_path))
+            size = f.size()
+    else:
+        size = os.path.getsize(ted_db_gz)
+
+    # More ranges than processes keeps the workers evenly loaded
+    bounds = np.linspace(0, size, processes * 4 + 1, dtype=np.int64)
+    ranges = [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    rows, output_ids = [], []
+    try:
+        # spawn: don't fork a parent that already runs decompression/progress threads
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes, initializer=_init_scan_worker,
+                      initargs=(str(ted_db_gz), index_path, keyword, target_ids)) as pool:
+            # imap keeps ranges, and so rows, in file order
+            for range_rows, range_ids, n_lines in pool.imap(_scan_range, ranges):
+                rows.extend(range_rows)
+                output_ids.extend(range_ids)
+                if progress is not None:
+                    progress.update(n_lines)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return rows, output_ids
+
 def filter_ted_summary(
     target_ids,
     ted_db_gz: str,
     filter_keyword: str = "Human",
-    total_lines: int = 364_806_077
+    total_lines: int = 364_806_077,
+    processes: int = 1,
+    gzip_index: str = None
 ) -> pd.DataFrame:
-    # Collect matching lines in memory
-    lines = []
+    # Scan raw bytes in large chunks and only decode the lines that match;
+    # matching lines are split into fields straight away, so the kept rows
+    # are never joined back into one string and re-parsed
+    keyword = filter_keyword.encode()
+    # Compare raw ID bytes against a frozenset so non-matching lines are never decoded
+    target_ids = frozenset(str(uid).encode() for uid in target_ids)
+    rows = []
     output_ids = []
-    with open_maybe_gzip(ted_db_gz) as fin:
-        for line in tqdm(fin, total=total_lines, unit='lines', ncols=100, desc="Filtering", smoothing=0.01):
-            if filter_keyword not in line:
-                continue
-            col1 = line.split('\t', 1)[0]
-            uniprot_id = extract_uniprot_id(col1)
-            if uniprot_id in target_ids:
-                lines.append(line)
-                output_ids.append(uniprot_id)
-
-    # Combine into one string and load into pandas
-    if lines:
-        data_str = ''.join(lines)
-        df = pd.read_csv(StringIO(data_str), sep='\t', names=TED_COLUMNS)
+    # With several processes and random access to the decompressed stream
+    # (plain file, or gzip through rapidgzip) byte ranges are scanned in parallel
+    parallel = processes > 1 and (rapidgzip is not None or not is_gzip(ted_db_gz))
+    fin = None
+    if not parallel:
+        # When grep is available it drops non-matching lines before Python sees them;
+        # the progress bar then counts matched lines and has no known total
+        fin = open_keyword_lines(ted_db_gz, filter_keyword)
+        if fin is None:
+            fin = open_maybe_gzip(ted_db_gz, binary=True)
+        else:
+            total_lines = None
+    # Progress only advances once per chunk, and redraws are throttled further
+    # so they never show up next to the scan itself
+    with tqdm(total=total_lines, unit='lines', ncols=100, desc="Filtering", smoothing=0.01,
+              miniters=1_000_000, mininterval=1.0) as progress:
+        if parallel:
+            rows, output_ids = scan_ted_parallel(
+                ted_db_gz, keyword, target_ids, processes, gzip_index, progress
+            )
+        else:
+            with fin:
+                for lines in read_line_chunks(fin):
+                    progress.update(len(lines))
+                    match_ted_lines(lines, keyword, target_ids, rows, output_ids)
+
+    if rows:
+        df = pd.DataFrame(rows, columns=TED_COLUMNS)
+        # Match read_csv: its default NA strings are missing and numeric columns are numbers
+        df = df.mask(df.isin(READ_CSV_NA_VALUES)).infer_objects()
+        df[TED_NUMERIC_COLUMNS] = df[TED_NUMERIC_COLUMNS].apply(pd.to_numeric)
+        df = df.astype(dict.fromkeys(TED_CATEGORICAL_COLUMNS, 'category'))
         df['uniprot_acc'] = output_ids
         return df
     else:
         return pd.DataFrame(columns=TED_COLUMNS)  # Empty if no match
+
+def filter_ted_summary_duckdb(
+    target_ids,
+    ted_db_gz: str,
+    filter_keyword: str = "Human"
+) -> pd.DataFrame:
+    # Streams the (optionally gzipped) TSV through DuckDB's parallel CSV reader,
+    # semi-joining on the UniProt ID so only matching rows are materialized.
+    # Unlike filter_ted_summary, the keyword is matched against tax_common_name only.
+    # The join doesn't keep file order, so rows are numbered as read and sorted back,
+    # giving the same row order as filter_ted_summary
+    con = duckdb.connect()
+    con.register('target_list', pd.DataFrame({'uniprot_acc': list(target_ids)}))
+    df = con.execute("""
+        WITH t AS (
+            SELECT *, row_number() OVER () AS file_row
+            FROM read_csv(?, delim='\t', header=False, columns=?)
+        )
+        SELECT t.* EXCLUDE (file_row), split_part(t.ted_id, '-', 2) AS uniprot_acc
+        FROM t
+        SEMI JOIN target_list tl
+            ON split_part(t.ted_id, '-', 2) = tl.uniprot_acc
+        WHERE contains(t.tax_common_name, ?)
+        ORDER BY t.file_row
+    """, [str(ted_db_gz), TED_COLUMN_TYPES, filter_keyword]).df()
+    con.close()
+    return df.astype(dict.fromkeys(TED_CATEGORICAL_COLUMNS, 'category'))
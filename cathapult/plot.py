@@ -126,12 +126,18 @@ for group_value in [2, 3, 4]:
     x_min, x_max = ax.get_xlim()
     x_offset = (x_max - x_min) * LABEL_OFFSET_FRAC
     
-    for i, row in df_plot.iterrows():
+    # Iterate plain column arrays; iterrows would box every row into a Series
+    for x, y, feature_id, feature_name in zip(
+        df_plot["neg_log10_p"].to_numpy() + x_offset,
+        y_pos,
+        df_plot[feature_id_header].to_numpy(),
+        df_plot["resolved_feature_name"].to_numpy(),
+    ):
         # Bold feature ID
         ax.text(
-            row["neg_log10_p"] + x_offset,
-            y_pos[i],
-            str(row[feature_id_header]),
+            x,
+            y,
+            str(feature_id),
             va="center",
             ha="left",
             fontsize=10,
@@ -140,9 +146,9 @@ for group_value in [2, 3, 4]:
         
         # Feature name (normal weight)
         ax.text(
-            row["neg_log10_p"] + x_offset,
-            y_pos[i] - 0.4 * Y_SPACING,
-            str(row["resolved_feature_name"]),
+            x,
+            y - 0.4 * Y_SPACING,
+            str(feature_name),
             va="center",
             ha="left",
             fontsize=9